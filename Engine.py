@@ -2,22 +2,29 @@ from kivy.clock import mainthread
 from kivy.storage.dictstore import DictStore
 from kivy.logger import Logger
 from worker import WorkerThread
-from sunfish.sunfish import (initial, parse, render, Position, Searcher, MATE_LOWER,MATE_UPPER)
+from power import PowerPolicy, ThrottledSearcher
+from tables import load_tables
+from utils import is_mobile
+from sunfish.sunfish import (initial, parse, render, Position, MATE_LOWER,MATE_UPPER)
 import chess
 import re
-import time
+
+# use the tuned piece-square tables, if any (see tune.py)
+load_tables()
 
 #############################################################################
 # Interface with the Sunfish engine directly, no xboard / uci
 #############################################################################
 class Engine:
-    def __init__(self, dispatch, resume=True):
+    def __init__(self, dispatch, resume=True, policy=None):
         self.__dispatch = dispatch
         self.__worker = WorkerThread()
         self.hist = [Position(initial, 0, (True,True), (True,True), 0, 0)]
         self.board = chess.Board()
         self.redo = []
-        self.searcher = Searcher()
+        if policy is None:
+            policy = PowerPolicy.mobile() if is_mobile() else PowerPolicy()
+        self.searcher = ThrottledSearcher(policy)
         self.store = DictStore('fisher.dat')
         if resume:
             self.load_game()
@@ -89,13 +96,19 @@ class Engine:
             move = [119 - m for m in move]
         return '{}{}'.format(*(render(m) for m in move))
 
-    # Fire up the engine to look for a move -- in the background thread
+    @property
+    def policy(self):
+        return self.searcher.policy
+
+    @policy.setter
+    def policy(self, policy):
+        self.searcher.policy = policy
+
+    # Fire up the engine to look for a move -- in the background thread;
+    # the search is throttled by the power policy, see power.py
     def search_move(self):
         def search():
-            start = time.time()
-            for _depth, move, _score in self.searcher.search(self.hist[-1], self.hist):
-                if time.time() - start > 1:
-                    break
+            move = self.searcher.search_move(self.hist[-1], self.hist)
             self.apply_move(move)
             self.save_game()
         self.__worker.send_message(search)
@@ -0,0 +1,275 @@
+from collections import OrderedDict, deque
+from convert import chess_move, sunfish_position
+from power import LEVELS, ThrottledSearcher, init_worker, worker
+from sunfish.sunfish import MATE_LOWER, MATE_UPPER
+import argparse
+import chess
+import chess.pgn
+import io
+import json
+import multiprocessing
+import pickle
+import sys
+import time
+
+#############################################################################
+# Batch analysis of finished games: stream PGN (or games saved by
+# Engine.save_game) through a pool of processes, one Searcher per worker,
+# and write the games back, in order, annotated with evaluations.
+#############################################################################
+
+BLUNDER = 200   # centipawns lost by the move played, compared to the best move
+MISTAKE = 100
+TABLE_LIMIT = 1000000   # start over with a fresh Searcher when tables get this big
+
+
+class LRUCache:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.__data = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.__data
+
+    def __len__(self):
+        return len(self.__data)
+
+    def get(self, key):
+        if key in self.__data:
+            self.__data.move_to_end(key)
+            return self.__data[key]
+
+    def put(self, key, value):
+        self.__data[key] = value
+        self.__data.move_to_end(key)
+        while len(self.__data) > self.capacity:
+            self.__data.popitem(last=False)
+
+
+#############################################################################
+# Worker process side
+#############################################################################
+def analyze_position(searcher, board):
+    if board.is_checkmate():
+        return None, -MATE_UPPER
+    if board.is_game_over():
+        return None, 0
+    move, score = searcher.analyze(sunfish_position(board))
+    return (chess_move(move, board).uci() if move else None), score
+
+
+# analyze positions given as EPD, return {epd: (best move, score)}
+def _analyze(positions):
+    searcher = worker()
+    results = {epd: analyze_position(searcher, chess.Board(epd + ' 0 1')) for epd in positions}
+    if len(searcher.tp_move) + len(searcher.tp_score) > TABLE_LIMIT:
+        searcher.reset()
+    return results
+
+
+#############################################################################
+# Input
+#############################################################################
+def read_pgn(path):
+    with open(path) as f:
+        while True:
+            game = chess.pgn.read_game(f)
+            if game is None:
+                break
+            yield game
+
+
+# read game saved by Engine.save_game (kivy DictStore is a pickled dict)
+def read_saved_game(path):
+    with open(path, 'rb') as f:
+        data = pickle.load(f)
+    moves = data.get('game', {}).get('moves', [])
+    if moves:
+        game = chess.pgn.Game()
+        game.headers.update(Event='Fisher', White='Human', Black='Sunfish')
+        node = game
+        for move in moves:
+            node = node.add_variation(move)
+        yield game
+
+
+def read_games(paths):
+    for path in paths:
+        yield from (read_saved_game(path) if path.endswith('.dat') else read_pgn(path))
+
+
+def game_positions(game):
+    board = game.board()
+    positions = [board.epd()]
+    for move in game.mainline_moves():
+        board.push(move)
+        positions.append(board.epd())
+    return positions
+
+
+#############################################################################
+# Output
+#############################################################################
+def pawns(score):
+    score = max(-MATE_LOWER, min(MATE_LOWER, score))
+    return round(score / 100, 2)
+
+
+# sunfish does not tell the distance to mate: 1 or -1, or None if no mate
+def mate(score):
+    if abs(score) >= MATE_LOWER:
+        return 1 if score > 0 else -1
+
+
+def format_eval(score):
+    return '#{}'.format(mate(score)) if mate(score) else '{:.2f}'.format(pawns(score))
+
+
+# annotate game in place, evals[i] is (best move, score) for the position before the i-th move
+def annotate(game, evals):
+    annotations = []
+    for i, node in enumerate(game.mainline()):
+        best, score = evals[i]
+        loss = score + evals[i + 1][1]  # best score minus score of move played, for the mover
+        value = evals[i + 1][1] if node.turn() == chess.WHITE else -evals[i + 1][1]
+        nag = None
+        if loss >= BLUNDER:
+            nag = chess.pgn.NAG_BLUNDER
+        elif loss >= MISTAKE:
+            nag = chess.pgn.NAG_MISTAKE
+        comment = '[%eval {}]'.format(format_eval(value))
+        if nag:
+            node.nags.add(nag)
+            comment += ' best: {}'.format(best)
+        node.comment = (node.comment + ' ' + comment).strip()
+        annotations.append({
+            'move': node.move.uci(),
+            'best': best,
+            'eval': None if mate(value) else pawns(value),
+            'mate': mate(value),
+            'loss': pawns(max(loss, 0)),
+            'nag': {chess.pgn.NAG_BLUNDER: '??', chess.pgn.NAG_MISTAKE: '?'}.get(nag),
+        })
+    return annotations
+
+
+def write_pgn(out, game, _annotations):
+    print(game, file=out, end='\n\n', flush=True)
+
+
+def write_jsonl(out, game, annotations):
+    record = {'headers': dict(game.headers), 'moves': annotations}
+    print(json.dumps(record), file=out, flush=True)
+
+
+#############################################################################
+# Pipeline
+#############################################################################
+class Analyzer:
+    def __init__(self, processes=None, nodes=LEVELS[4], window=None, cache_size=100000):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.nodes = nodes
+        self.window = window or 2 * self.processes  # games in flight
+        if cache_size < self.window:
+            raise ValueError('cache size must be at least {} (games in flight)'.format(self.window))
+        self.cache = LRUCache(cache_size)
+        self.positions = 0
+        self.searched = 0
+        self.__searcher = None
+
+    # fallback, for positions evicted from the cache while their game was in flight
+    def __analyze_locally(self, epd):
+        if self.__searcher is None:
+            self.__searcher = ThrottledSearcher.for_nodes(self.nodes)
+        self.searched += 1
+        return analyze_position(self.__searcher, chess.Board(epd + ' 0 1'))
+
+    def __finish(self, inflight, pending):
+        game, positions, result = inflight.popleft()
+        searched = result.get()
+        for epd, value in searched.items():
+            pending.discard(epd)
+            self.cache.put(epd, value)
+        # positions not searched for this game were searched for earlier ones
+        evals = []
+        for epd in positions:
+            value = searched[epd] if epd in searched else self.cache.get(epd)
+            if value is None:
+                value = self.__analyze_locally(epd)
+                self.cache.put(epd, value)
+            evals.append(value)
+        self.positions += len(positions)
+        return game, annotate(game, evals)
+
+    # yield (game, annotations), in input order
+    def run(self, games):
+        inflight = deque()
+        pending = set()  # submitted, but not in the cache yet
+        with multiprocessing.Pool(self.processes, init_worker, (self.nodes,)) as pool:
+            for game in games:
+                positions = game_positions(game)
+                todo = [epd for epd in dict.fromkeys(positions) if epd not in self.cache and epd not in pending]
+                pending.update(todo)
+                self.searched += len(todo)
+                inflight.append((game, positions, pool.apply_async(_analyze, (todo,))))
+                if len(inflight) >= self.window:
+                    yield self.__finish(inflight, pending)
+            while inflight:
+                yield self.__finish(inflight, pending)
+
+
+# run the same games with 1, 2, 4 ... processes; annotate modifies
+# the games in place, so every run starts over from the PGN text
+def scaling(games, nodes, max_processes):
+    texts = [str(game) for game in games]
+    base = None
+    counts = sorted({1, max_processes} | {n for n in (2, 4, 8, 16, 32, 64) if n < max_processes})
+    for n in counts:
+        analyzer = Analyzer(processes=n, nodes=nodes)
+        start = time.time()
+        for _ in analyzer.run(chess.pgn.read_game(io.StringIO(text)) for text in texts):
+            pass
+        rate = analyzer.positions / (time.time() - start)
+        base = base or rate
+        print('{:>3} processes: {:8.1f} positions/sec, speedup {:.2f}x'.format(n, rate, rate / base), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Annotate finished games with Sunfish evaluations')
+    parser.add_argument('input', nargs='+', help='PGN files, or fisher.dat saved games')
+    parser.add_argument('-o', '--output', help='output file (default: stdout)')
+    parser.add_argument('-f', '--format', choices=['pgn', 'jsonl'], help='default: guessed from output, or pgn')
+    parser.add_argument('-j', '--processes', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('-n', '--nodes', type=int, default=LEVELS[4], help='nodes searched per position')
+    parser.add_argument('--cache', type=int, default=100000, help='max positions in the cache')
+    parser.add_argument('--scaling', type=int, metavar='GAMES', help='report positions/sec by core count over GAMES games')
+    args = parser.parse_args()
+
+    games = read_games(args.input)
+
+    if args.scaling:
+        scaling((game for _, game in zip(range(args.scaling), games)), args.nodes, args.processes)
+        return
+
+    fmt = args.format or ('jsonl' if args.output and args.output.endswith('.jsonl') else 'pgn')
+    write = write_jsonl if fmt == 'jsonl' else write_pgn
+
+    try:
+        analyzer = Analyzer(processes=args.processes, nodes=args.nodes, cache_size=args.cache)
+    except ValueError as e:
+        parser.error(str(e))
+    out = open(args.output, 'w') if args.output else sys.stdout
+    start = time.time()
+    try:
+        for game, annotations in analyzer.run(games):
+            write(out, game, annotations)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.time() - start
+    print('{} positions ({} searched) in {:.1f}s: {:.1f} positions/sec'.format(
+        analyzer.positions, analyzer.searched, elapsed, analyzer.positions / elapsed), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+from sunfish.sunfish import Position, pst, render
+import chess
+
+#############################################################################
+# Conversions between python-chess boards and sunfish positions.
+# Sunfish always sees the board from the side to move, with 120 squares
+# (10x12 mailbox, A1 == 91); black's positions are rotated.
+#############################################################################
+
+def square_index(square):
+    return 91 + chess.square_file(square) - 10 * chess.square_rank(square)
+
+
+def sunfish_position(board):
+    rows = [' ' * 9] * 2
+    for rank in range(7, -1, -1):
+        row = ''
+        for file in range(8):
+            piece = board.piece_at(chess.square(file, rank))
+            row += piece.symbol() if piece else '.'
+        rows.append(' ' + row)
+    rows += [' ' * 9] * 2
+    text = ''.join(row + '\n' for row in rows)
+
+    score = 0
+    for i, p in enumerate(text):
+        if p.isupper():
+            score += pst[p][i]
+        elif p.islower():
+            score -= pst[p.upper()][119 - i]
+
+    wc = (board.has_queenside_castling_rights(chess.WHITE), board.has_kingside_castling_rights(chess.WHITE))
+    bc = (board.has_kingside_castling_rights(chess.BLACK), board.has_queenside_castling_rights(chess.BLACK))
+    ep = square_index(board.ep_square) if board.ep_square is not None else 0
+
+    pos = Position(text, score, wc, bc, ep, 0)
+    return pos if board.turn == chess.WHITE else pos.rotate()
+
+
+# convert sunfish move (in the frame of the side to move) into python-chess move
+def chess_move(move, board):
+    if board.turn == chess.BLACK:
+        move = [119 - m for m in move]
+    move = chess.Move.from_uci('{}{}'.format(*(render(m) for m in move)))
+    if board.piece_type_at(move.from_square) == chess.PAWN and chess.square_rank(move.to_square) in (0, 7):
+        move.promotion = chess.QUEEN  # sunfish only ever promotes to queen
+    return move
@@ -0,0 +1,175 @@
+from sunfish.sunfish import Searcher
+import time
+
+#############################################################################
+# Power policy: cap the engine's node rate and per-move node budget, so
+# that searching on phones does not pin a core (and trigger throttling).
+#############################################################################
+
+# strength level -> max nodes searched per move (None: no limit)
+LEVELS = {
+    1: 500,
+    2: 1500,
+    3: 4000,
+    4: 10000,
+    5: 25000,
+    6: 60000,
+    7: 150000,
+    8: None,
+}
+
+MOBILE_LEVEL = 3
+MOBILE_NPS = 4000
+TIME_LIMIT = 1      # seconds per move, when there is no node budget
+
+
+class BudgetExhausted(Exception):
+    pass
+
+
+class PowerPolicy:
+    def __init__(self, nps=None, node_budget=None, time_limit=TIME_LIMIT, slice_nodes=500):
+        # the search must stop somewhere: without a node budget, limit the time
+        if node_budget is None and time_limit is None:
+            time_limit = TIME_LIMIT
+        self.nps = nps                  # nodes-per-second cap (None: full speed)
+        self.node_budget = node_budget  # total nodes per move (None: no limit)
+        self.time_limit = time_limit    # seconds per move (None: no limit)
+        self.slice_nodes = slice_nodes  # nodes searched between duty-cycle checks
+
+    @staticmethod
+    def from_level(level, nps=None, time_limit=None):
+        if level not in LEVELS:
+            raise ValueError('level must be one of {}'.format(sorted(LEVELS)))
+        return PowerPolicy(nps=nps, node_budget=LEVELS[level], time_limit=time_limit)
+
+    @staticmethod
+    def mobile():
+        return PowerPolicy.from_level(MOBILE_LEVEL, nps=MOBILE_NPS)
+
+    def __repr__(self):
+        return 'PowerPolicy(nps={}, node_budget={}, time_limit={})'.format(
+            self.nps, self.node_budget, self.time_limit)
+
+
+class ThrottledSearcher(Searcher):
+    def __init__(self, policy=None):
+        super().__init__()
+        self.policy = policy or PowerPolicy()
+        self.__start = 0
+        self.__next_check = 0
+        self.__move = None
+
+    @staticmethod
+    def for_nodes(nodes):
+        return ThrottledSearcher(PowerPolicy(node_budget=nodes, time_limit=None))
+
+    # start over with empty tables
+    def reset(self):
+        Searcher.__init__(self)
+
+    def bound(self, *args, **kwargs):
+        if self.nodes >= self.__next_check:
+            self.__next_check = self.nodes + self.policy.slice_nodes
+            self.__throttle()
+        return super().bound(*args, **kwargs)
+
+    def __throttle(self):
+        policy = self.policy
+        if policy.nps:
+            # sleep off whatever we are ahead of the allowed node rate
+            ahead = self.nodes / policy.nps - (time.time() - self.__start)
+            if ahead > 0:
+                time.sleep(ahead)
+        # never give up before the first iteration produced a move
+        if self.__move:
+            if policy.node_budget is not None and self.nodes >= policy.node_budget:
+                raise BudgetExhausted()
+            if policy.time_limit and time.time() - self.__start >= policy.time_limit:
+                raise BudgetExhausted()
+
+    # Search for the best move in pos, within the limits of the policy;
+    # return the move and its score, from the point of view of the side to move
+    def analyze(self, pos, hist=()):
+        self.__start = time.time()
+        self.__next_check = 0
+        self.__move, score = None, 0
+        try:
+            for _depth, move, _score in self.search(pos, hist):
+                self.__move, score = move, _score
+                if self.policy.time_limit and time.time() - self.__start > self.policy.time_limit:
+                    break
+        except BudgetExhausted:
+            pass
+        return self.__move, score
+
+    def search_move(self, pos, hist=()):
+        return self.analyze(pos, hist)[0]
+
+
+# One searcher per worker process, for process pools (analyze.py, tune.py)
+_worker = None
+
+def init_worker(nodes):
+    global _worker
+    _worker = ThrottledSearcher.for_nodes(nodes)
+
+
+def worker():
+    return _worker
+
+
+# Headless check: CPU time and nodes per move against the configured budget.
+# CPU time is bounded by the nodes searched at full speed, and by the time
+# limit; with a rate cap, the CPU must also idle for the rest of the move.
+def check_budget(tolerance=1.5, overhead=0.05):
+    from sunfish.sunfish import initial, Position
+
+    pos = Position(initial, 0, (True,True), (True,True), 0, 0)
+
+    def measure(policy):
+        searcher = ThrottledSearcher(policy)
+        wall, cpu = time.time(), time.process_time()
+        move = searcher.search_move(pos, [pos])
+        wall, cpu = time.time() - wall, time.process_time() - cpu
+        print('{}: move={} nodes={} cpu={:.3f}s wall={:.3f}s'.format(policy, move, searcher.nodes, cpu, wall))
+        return move, searcher.nodes, cpu, wall
+
+    # calibrate: nodes per CPU second, at full speed
+    _, nodes, cpu, _ = measure(PowerPolicy.from_level(4))
+    speed = nodes / max(cpu, 1e-3)
+    print('full speed: {:.0f} nodes/sec'.format(speed))
+
+    failures = []
+    policies = [PowerPolicy.from_level(level) for level in (2, 8)]
+    policies += [PowerPolicy.from_level(3, nps=speed / 4), PowerPolicy.mobile()]
+    for policy in policies:
+        move, nodes, cpu, wall = measure(policy)
+        limits = []
+        if policy.node_budget is not None:
+            limits.append((policy.node_budget + policy.slice_nodes) / speed)
+        if policy.time_limit:
+            limits.append(policy.time_limit)
+        expected = min(limits) * tolerance + overhead
+        if not move:
+            failures.append('{}: no move'.format(policy))
+        if policy.node_budget is not None and nodes > policy.node_budget + policy.slice_nodes:
+            failures.append('{}: {} nodes over budget'.format(policy, nodes))
+        if cpu > expected:
+            failures.append('{}: cpu {:.3f}s over {:.3f}s'.format(policy, cpu, expected))
+        if policy.nps:
+            if nodes / wall > policy.nps * 1.1:
+                failures.append('{}: {:.0f} nodes/sec over the cap'.format(policy, nodes / wall))
+            duty = min(1, policy.nps / speed)
+            if cpu > wall * duty * tolerance + overhead:
+                failures.append('{}: cpu {:.3f}s, expected duty cycle {:.2f} of {:.3f}s'.format(policy, cpu, duty, wall))
+    return failures
+
+
+if __name__ == '__main__':
+    import sys
+
+    failures = check_budget()
+    for failure in failures:
+        print('FAILED', failure)
+    sys.exit(1 if failures else 0)
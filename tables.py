@@ -0,0 +1,44 @@
+from sunfish import sunfish
+import json
+import os
+
+#############################################################################
+# Piece-square tables, in the (unpadded) form used by the sunfish source:
+# material value per piece, and 64 entries per piece, rank 8 first, from
+# white's point of view. Sunfish pads them to 120 squares and adds the
+# material value to each entry; see sunfish.py
+#############################################################################
+
+PIECES = 'PNBRQK'
+TABLES = 'pst.json'
+
+
+def get_tables():
+    piece = {p: sunfish.piece[p] for p in PIECES}
+    pst = {p: [sunfish.pst[p][21 + 10 * row + file] - piece[p] for row in range(8) for file in range(8)] for p in PIECES}
+    return piece, pst
+
+
+def set_tables(piece, pst):
+    for p in PIECES:
+        sunfish.piece[p] = piece[p]
+        table = pst[p]
+        padded = (0,) * 20
+        for row in range(8):
+            padded += (0,) + tuple(x + piece[p] for x in table[row * 8: row * 8 + 8]) + (0,)
+        sunfish.pst[p] = padded + (0,) * 20
+
+
+def save_tables(piece, pst, path=TABLES):
+    with open(path, 'w') as f:
+        json.dump({'piece': piece, 'pst': pst}, f, indent=1)
+
+
+# replace the engine's tables with tuned ones, if any
+def load_tables(path=TABLES):
+    if not os.path.exists(path):
+        return False
+    with open(path) as f:
+        data = json.load(f)
+    set_tables(data['piece'], data['pst'])
+    return True
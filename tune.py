@@ -0,0 +1,268 @@
+from convert import chess_move, sunfish_position
+from power import LEVELS, init_worker, worker
+from sunfish.sunfish import MATE_LOWER
+from tables import PIECES, TABLES, get_tables, save_tables
+import argparse
+import chess
+import multiprocessing
+import numpy as np
+import os
+import random
+import struct
+import sys
+import time
+
+#############################################################################
+# Tune the piece-square tables for the fast searches the app actually uses:
+#   generate: play sunfish against itself, stream positions to a binary file
+#   train:    memory-map the file, fit material and PST with Texel's method
+# The tables are exported to pst.json, which the Engine loads at startup.
+#############################################################################
+
+# Fixed-width record: 64 squares (a1..h8) packed two per byte, one piece
+# code per nibble (0: empty, 1-6: white PNBRQK, 7-12: black), side to move,
+# game result from white's point of view (0: loss, 1: draw, 2: win), ply.
+RECORD = struct.Struct('<32sBBH')
+RECORD_DTYPE = np.dtype([('board', 'u1', 32), ('turn', 'u1'), ('result', 'u1'), ('ply', '<u2')])
+assert RECORD.size == RECORD_DTYPE.itemsize
+
+MAX_PLIES = 300
+RANDOM_PLIES = 8    # random opening moves, for variety; not recorded
+
+NPARAMS = len(PIECES) * 65  # material, then 64 PST entries per piece
+CHUNK = 1 << 20     # records shuffled in memory at once (36 MB)
+SCALES = np.linspace(0.1, 3.0, 59)
+
+
+#############################################################################
+# Self-play
+#############################################################################
+def encode(board, result, ply):
+    codes = bytearray(64)
+    for square, piece in board.piece_map().items():
+        codes[square] = piece.piece_type + (0 if piece.color == chess.WHITE else 6)
+    packed = bytes(codes[i] | codes[i + 1] << 4 for i in range(0, 64, 2))
+    return RECORD.pack(packed, int(board.turn == chess.WHITE), result, ply)
+
+
+# play one game, return its quiet positions as packed records: not in check,
+# and the best move found is neither a capture nor a promotion. Games that
+# end without a result (sunfish has no legal move to offer) are dropped.
+def play_game(seed):
+    searcher = worker()
+    rand = random.Random(seed)
+    board = chess.Board()
+    for _ in range(RANDOM_PLIES):
+        moves = list(board.legal_moves)
+        if not moves:
+            break
+        board.push(rand.choice(moves))
+
+    positions = []
+    result = 1
+    while len(board.move_stack) < MAX_PLIES and not board.is_game_over(claim_draw=True):
+        move, score = searcher.analyze(sunfish_position(board))
+        move = chess_move(move, board) if move else None
+        if move is None or move not in board.legal_moves:
+            positions = []
+            break
+        if abs(score) >= MATE_LOWER:
+            # adjudicate, from the point of view of the side to move
+            result = 2 if (score > 0) == (board.turn == chess.WHITE) else 0
+            break
+        if not (board.is_check() or board.is_capture(move) or move.promotion):
+            positions.append(board.copy(stack=False))
+        board.push(move)
+    else:
+        if board.is_checkmate():
+            result = 0 if board.turn == chess.WHITE else 2
+
+    searcher.reset()  # keep tables from growing
+    return b''.join(encode(pos, result, pos.ply()) for pos in positions)
+
+
+def generate(path, games, processes, nodes, seed):
+    count = 0
+    start = time.time()
+    with open(path, 'ab') as out, multiprocessing.Pool(processes, init_worker, (nodes,)) as pool:
+        for records in pool.imap_unordered(play_game, range(seed, seed + games)):
+            out.write(records)
+            count += len(records) // RECORD.size
+            print('\r{} positions, {:.1f}/sec'.format(count, count / (time.time() - start)), end='', file=sys.stderr)
+    print(file=sys.stderr)
+
+
+#############################################################################
+# Training
+#############################################################################
+def load_records(path):
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r')
+
+
+# PST index, for each square a1..h8, of a white piece and of a black piece;
+# sunfish evaluates black's pieces on the board rotated by 180 degrees
+SQUARES = np.arange(64)
+WHITE_INDEX = (7 - SQUARES // 8) * 8 + SQUARES % 8
+BLACK_INDEX = (SQUARES // 8) * 8 + 7 - SQUARES % 8
+
+
+# features X such that X @ params is the evaluation from white's point of view
+def features(records):
+    n = len(records)
+    board = np.asarray(records['board'])
+    codes = np.empty((n, 64), dtype=np.uint8)
+    codes[:, 0::2] = board & 15
+    codes[:, 1::2] = board >> 4
+
+    x = np.zeros((n, NPARAMS), dtype=np.float32)
+    for i in range(len(PIECES)):
+        x[:, i] = (codes == i + 1).sum(axis=1, dtype=np.int8) - (codes == i + 7).sum(axis=1, dtype=np.int8)
+
+    # (row, index) pairs are unique per color, so fancy indexing is safe;
+    # cast the piece codes first, uint8 arithmetic wraps around at 256
+    rows, squares = np.nonzero((codes >= 1) & (codes <= 6))
+    pieces = codes[rows, squares].astype(np.intp) - 1
+    x[rows, len(PIECES) + pieces * 64 + WHITE_INDEX[squares]] += 1
+    rows, squares = np.nonzero(codes >= 7)
+    pieces = codes[rows, squares].astype(np.intp) - 7
+    x[rows, len(PIECES) + pieces * 64 + BLACK_INDEX[squares]] -= 1
+    return x
+
+
+def targets(records):
+    return np.asarray(records['result'], dtype=np.float32) / 2
+
+
+def predict(x, params, k):
+    return 1 / (1 + 10 ** (-k * (x @ params) / 400))
+
+
+def params_from_tables(piece, pst):
+    return np.array([piece[p] for p in PIECES] + [v for p in PIECES for v in pst[p]], dtype=np.float32)
+
+
+def tables_from_params(params):
+    params = np.rint(params).astype(int).tolist()
+    piece = dict(zip(PIECES, params[:len(PIECES)]))
+    pst = {p: params[len(PIECES) + i * 64: len(PIECES) + (i + 1) * 64] for i, p in enumerate(PIECES)}
+    return piece, pst
+
+
+# Records are written a game at a time, so consecutive records are strongly
+# correlated. Read the file in chunks, at a random offset and in random order,
+# and shuffle each chunk in memory before cutting it into mini-batches.
+def batches(records, batch_size, rand, chunk_size=CHUNK):
+    chunk_size = max(chunk_size, batch_size)
+    offset = int(rand.integers(len(records)))
+    starts = list(range(offset, len(records), chunk_size)) + list(range(offset - chunk_size, -chunk_size, -chunk_size))
+    rand.shuffle(starts)
+    for start in starts:
+        chunk = np.array(records[max(start, 0):min(start + chunk_size, len(records))])
+        chunk = chunk[rand.permutation(len(chunk))]
+        for i in range(0, len(chunk), batch_size):
+            batch = chunk[i:i + batch_size]
+            yield features(batch), targets(batch)
+
+
+# pick the scaling constant that best fits the current tables, on a random sample
+def fit_scale(records, params, size, rand):
+    rows = np.sort(rand.choice(len(records), size=min(size, len(records)), replace=False))
+    sample = records[rows]
+    x, y = features(sample), targets(sample)
+    errors = [np.mean((predict(x, params, k) - y) ** 2) for k in SCALES]
+    best = int(np.argmin(errors))
+    if best in (0, len(SCALES) - 1):
+        print('warning: scale={:.2f} is at the edge of the search range [{:.2f}, {:.2f}]'.format(
+            SCALES[best], SCALES[0], SCALES[-1]), file=sys.stderr)
+    return SCALES[best]
+
+
+def train(path, epochs, batch_size, rate, seed):
+    if os.path.getsize(path) < RECORD.size:
+        raise ValueError('{}: no records'.format(path))
+    records = load_records(path)
+    piece, pst = get_tables()
+    params = params_from_tables(piece, pst)
+    king = params[PIECES.index('K')]
+
+    rand = np.random.default_rng(seed)
+    k = fit_scale(records, params, batch_size, rand)
+    print('{} positions, scale={:.2f}'.format(len(records), k), file=sys.stderr)
+
+    # Adam
+    m = np.zeros_like(params)
+    v = np.zeros_like(params)
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+    step = 0
+    for epoch in range(epochs):
+        total, count = 0.0, 0
+        for x, y in batches(records, batch_size, rand):
+            p = predict(x, params, k)
+            error = p - y
+            grad = x.T @ (error * p * (1 - p)) * (2 * k * np.log(10) / 400 / len(y))
+            step += 1
+            m = beta1 * m + (1 - beta1) * grad
+            v = beta2 * v + (1 - beta2) * grad * grad
+            params -= rate * (m / (1 - beta1 ** step)) / (np.sqrt(v / (1 - beta2 ** step)) + eps)
+            params[PIECES.index('K')] = king  # the king's material value cancels out, keep it for mate scores
+            total += float(np.sum(error ** 2))
+            count += len(y)
+        print('epoch {}: error={:.6f}'.format(epoch + 1, total / count), file=sys.stderr)
+
+    return tables_from_params(params)
+
+
+# check that the features reproduce the sunfish evaluation, on random boards
+def check_features(games=20, seed=0):
+    rand = random.Random(seed)
+    params = params_from_tables(*get_tables())
+    failures = []
+    for _ in range(games):
+        board = chess.Board()
+        while not board.is_game_over() and len(board.move_stack) < 100:
+            board.push(rand.choice(list(board.legal_moves)))
+            records = np.frombuffer(encode(board, 1, board.ply()), dtype=RECORD_DTYPE)
+            value = int(np.rint(features(records) @ params)[0])
+            score = sunfish_position(board).score
+            score = score if board.turn == chess.WHITE else -score
+            if value != score:
+                failures.append('{}: features {} != sunfish {}'.format(board.fen(), value, score))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tune the Sunfish piece-square tables')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    gen = commands.add_parser('generate', help='append self-play positions to a record file')
+    gen.add_argument('output')
+    gen.add_argument('-g', '--games', type=int, default=1000)
+    gen.add_argument('-j', '--processes', type=int, default=multiprocessing.cpu_count())
+    gen.add_argument('-n', '--nodes', type=int, default=LEVELS[2], help='nodes searched per move')
+    gen.add_argument('-s', '--seed', type=int, default=0)
+
+    fit = commands.add_parser('train', help='fit the tables to a record file')
+    fit.add_argument('input')
+    fit.add_argument('-o', '--output', default=TABLES)
+    fit.add_argument('-e', '--epochs', type=int, default=5)
+    fit.add_argument('-b', '--batch-size', type=int, default=16384)
+    fit.add_argument('-r', '--rate', type=float, default=1.0, help='learning rate')
+    fit.add_argument('-s', '--seed', type=int, default=0)
+
+    commands.add_parser('check', help='check the features against the sunfish evaluation')
+
+    args = parser.parse_args()
+    if args.command == 'check':
+        failures = check_features()
+        for failure in failures:
+            print('FAILED', failure)
+        sys.exit(1 if failures else 0)
+    elif args.command == 'generate':
+        generate(args.output, args.games, args.processes, args.nodes, args.seed)
+    else:
+        piece, pst = train(args.input, args.epochs, args.batch_size, args.rate, args.seed)
+        save_tables(piece, pst, args.output)
+
+
+if __name__ == '__main__':
+    main()